@@ -1,8 +1,16 @@
+import io
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import altair as alt
-from datetime import datetime, timedelta
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from datetime import timedelta
+
+# Resolved once per run; normalized to midnight so cached computations keyed on
+# it stay valid for the whole day instead of changing every rerun.
+TODAY = pd.Timestamp.today().normalize()
 
 # ---------------------------------------------------
 # PAGE CONFIG
@@ -16,6 +24,90 @@ st.title("📦 Hospital Consignment Intelligence Demo")
 st.write("Upload a dataset or load the built-in demo file to analyze consumption, stock levels, expiry risk, and recommended quantities.")
 
 
+# ---------------------------------------------------
+# DATA LOADING
+# ---------------------------------------------------
+CATEGORY_COLS = [
+    "Record_Type", "Hospital_ID", "Hospital_Name",
+    "Product_ID", "Product_Name", "Product_Category", "Usage_Family",
+]
+DATE_COLS = ["Movement_Date", "Expiry_Date", "Consignment_Start_Date"]
+NUMERIC_COLS = ["Movement_Qty", "Current_Stock"]
+
+
+def prepare(df):
+    """Validate and type the raw frame once, inside the cached loaders."""
+    missing_cols = [c for c in CATEGORY_COLS + DATE_COLS + NUMERIC_COLS
+                    if c not in df.columns]
+    if missing_cols:
+        raise ValueError(f"Missing required columns: {', '.join(missing_cols)}")
+
+    # Low-cardinality strings repeated across every movement row: store them as
+    # categoricals so groupby/merge/filter work on integer codes, not str objects.
+    # Columns the reader already dictionary-encoded arrive with categories in
+    # order of appearance; re-sort them so the filter option lists stay lexical.
+    for c in CATEGORY_COLS:
+        col = df[c]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            df[c] = col.cat.reorder_categories(sorted(col.cat.categories))
+        else:
+            df[c] = col.astype("category")
+
+    # Dates are ISO-8601 in these exports; a fixed format keeps pandas on the
+    # fast parsing path instead of inferring per element.
+    for c in DATE_COLS:
+        df[c] = pd.to_datetime(df[c], format="ISO8601", errors="coerce", cache=True)
+
+    # Quantities are small integer counts. Nullable Int32 stores the NaNs from
+    # the mixed movement/inventory layout in a bitmask, so the values stay
+    # packed 32-bit integers instead of being promoted to float64. Uploads
+    # with fractional or out-of-range quantities (which Int32 would refuse to
+    # cast) stay on the float path the app has always handled.
+    for c in NUMERIC_COLS:
+        s = pd.to_numeric(df[c], errors="coerce")
+        vals = s.dropna()
+        int32 = np.iinfo("int32")
+        if (vals % 1 == 0).all() and vals.between(int32.min, int32.max).all():
+            df[c] = s.astype("Int32")
+        else:
+            df[c] = pd.to_numeric(s, downcast="float")
+
+    return df
+
+
+def read_csv_arrow(source):
+    """Parse a CSV (path or buffer) with pyarrow's multithreaded reader.
+
+    Much faster than pandas' single-threaded C engine on large uploads, and
+    ISO dates come back already typed, so prepare() only has to coerce strays.
+    The identifier/name columns are dictionary-encoded during the read, so
+    they land directly as category dtype without ever materializing one
+    Python string per row.
+    """
+    convert = pacsv.ConvertOptions(
+        column_types={c: pa.dictionary(pa.int32(), pa.string())
+                      for c in CATEGORY_COLS}
+    )
+    return pacsv.read_csv(source, convert_options=convert).to_pandas(
+        date_as_object=False
+    )
+
+
+@st.cache_data(show_spinner=False)
+def load_file(csv_bytes):
+    return prepare(read_csv_arrow(io.BytesIO(csv_bytes)))
+
+
+@st.cache_data(show_spinner=False)
+def load_demo():
+    # Prefer the typed Parquet copy written by build_demo.py: it loads with
+    # all dtypes baked in, so neither parsing nor prepare() is needed.
+    try:
+        return pd.read_parquet("hospital_consignment_demo.parquet")
+    except (FileNotFoundError, OSError):
+        return prepare(read_csv_arrow("hospital_consignment_demo.csv"))
+
+
 # ---------------------------------------------------
 # DATA SOURCE SELECTION
 # ---------------------------------------------------
@@ -32,12 +124,15 @@ df = None
 if data_option == "Upload your CSV":
     uploaded = st.file_uploader("Upload your CSV file", type=["csv"])
     if uploaded is not None:
-        df = pd.read_csv(uploaded)
+        try:
+            df = load_file(uploaded.getvalue())
+        except ValueError as exc:
+            st.error(str(exc))
 
 # Option 2: Demo dataset
 elif data_option == "Use Demo Dataset":
     try:
-        df = pd.read_csv("hospital_consignment_demo.csv")
+        df = load_demo()
         st.success("Demo dataset loaded successfully.")
     except FileNotFoundError:
         st.error("Demo file not found. Please place 'hospital_consignment_demo.csv' in the same folder as app.py.")
@@ -47,19 +142,34 @@ if df is None:
     st.stop()
 
 
-# ---------------------------------------------------
-# DATA CLEANING
-# ---------------------------------------------------
-df["Movement_Date"] = pd.to_datetime(df["Movement_Date"], errors="coerce")
-df["Expiry_Date"] = pd.to_datetime(df["Expiry_Date"], errors="coerce")
-df["Consignment_Start_Date"] = pd.to_datetime(df["Consignment_Start_Date"], errors="coerce")
+# Separate movement + inventory. Movement rows only feed the filters and the
+# per-product aggregations, so carry just the columns those need; inventory
+# rows stay wide because the full results table is displayed.
+MOV_COLS = [
+    "Product_ID", "Hospital_Name", "Product_Category", "Product_Name",
+    "Movement_Date", "Movement_Qty",
+]
+
 
-df["Movement_Qty"] = pd.to_numeric(df["Movement_Qty"], errors="coerce")
-df["Current_Stock"] = pd.to_numeric(df["Current_Stock"], errors="coerce")
+@st.cache_data
+def split_records(df):
+    # Boolean selection already materializes fresh frames, and nothing below
+    # writes into them, so no defensive .copy() on top.
+    # df_mov is kept sorted by date (paid once, cached) so date-window cuts
+    # downstream are O(log N) searchsorted slices, not full-column scans.
+    # Rows without a movement date contribute to neither the window nor the
+    # gap averages.
+    df_mov = (
+        df.loc[df["Record_Type"] == "movement", MOV_COLS]
+        .dropna(subset=["Movement_Date"])
+        .sort_values("Movement_Date", kind="stable")
+        .reset_index(drop=True)
+    )
+    df_inv = df[df["Record_Type"] == "inventory"]
+    return df_mov, df_inv
 
-# Separate movement + inventory
-df_mov = df[df["Record_Type"] == "movement"].copy()
-df_inv = df[df["Record_Type"] == "inventory"].copy()
+
+df_mov, df_inv = split_records(df)
 
 
 # ---------------------------------------------------
@@ -67,122 +177,187 @@ df_inv = df[df["Record_Type"] == "inventory"].copy()
 # ---------------------------------------------------
 st.subheader("🔎 Filters")
 
-hospitals = ["All"] + sorted(df["Hospital_Name"].dropna().unique())
-categories = ["All"] + sorted(df["Product_Category"].dropna().unique())
-products = ["All"] + sorted(df["Product_Name"].dropna().unique())
 
-col1, col2, col3 = st.columns(3)
+@st.cache_data
+def filter_options(df):
+    # The loader makes these columns categorical, so the option lists are just
+    # the stored category metadata (already sorted, NaN-free) — no column scan.
+    # Fall back to a scan if a frame ever arrives without the cast (e.g. a
+    # demo Parquet built before the dtype work).
+    def options(col):
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            return col.cat.categories.tolist()
+        return sorted(col.dropna().unique())
 
-selected_hospital = col1.selectbox("Hospital", hospitals)
-selected_category = col2.selectbox("Product Category", categories)
-selected_product = col3.selectbox("Product Name", products)
+    return (
+        options(df["Hospital_Name"]),
+        options(df["Product_Category"]),
+        options(df["Product_Name"]),
+    )
 
-# Filter logic
-if selected_hospital != "All":
-    df_mov = df_mov[df_mov["Hospital_Name"] == selected_hospital]
-    df_inv = df_inv[df_inv["Hospital_Name"] == selected_hospital]
 
-if selected_category != "All":
-    df_mov = df_mov[df_mov["Product_Category"] == selected_category]
-    df_inv = df_inv[df_inv["Product_Category"] == selected_category]
+hospital_opts, category_opts, product_opts = filter_options(df)
+hospitals = ["All"] + hospital_opts
+categories = ["All"] + category_opts
+products = ["All"] + product_opts
 
-if selected_product != "All":
-    df_mov = df_mov[df_mov["Product_Name"] == selected_product]
-    df_inv = df_inv[df_inv["Product_Name"] == selected_product]
+col1, col2, col3 = st.columns(3)
 
+selected_hospital = col1.selectbox("Hospital", hospitals)
+selected_category = col2.selectbox("Product Category", categories)
+selected_product = col3.selectbox("Product Name", products)
 
 # ---------------------------------------------------
 # CALCULATIONS
 # ---------------------------------------------------
 st.subheader("📊 Analytics")
 
-today = datetime.today()
-six_months_ago = today - timedelta(days=180)
-
-# 1) Consumption last 6 months
-cons_last6 = (
-    df_mov[df_mov["Movement_Date"] >= six_months_ago]
-    .groupby("Product_ID")["Movement_Qty"]
-    .sum()
-    .reset_index()
-    .rename(columns={"Movement_Qty": "Consumption_6M"})
+CLASS_LABELS = ["A", "B", "C", "D"]
+FAMILY_BINS = {
+    "high": [7, 14, 30],
+    "medium": [14, 28, 60],
+    "low": [30, 60, 120],
+}
+# Weekly-consumption multipliers, rows per usage family, columns per class A-D
+FAMILY_INDEX = {"high": 0, "medium": 1, "low": 2}
+CLASS_MULTIPLIERS = np.array([
+    [3.0, 2.0, 1.0, 0.2],  # high
+    [2.0, 1.5, 1.0, 0.2],  # medium
+    [1.0, 1.0, 1.0, 0.0],  # low
+])
+
+
+@st.cache_data
+def compute_results(df_mov, df_inv, hospital, category, product, today):
+    """Filter + steps 1-6; cached so unchanged filters skip the recompute."""
+    # Filter logic — combine the active filters into one mask and slice once,
+    # instead of allocating an intermediate frame per filter
+    def filter_mask(frame):
+        mask = np.ones(len(frame), dtype=bool)
+        if hospital != "All":
+            mask &= (frame["Hospital_Name"] == hospital).to_numpy()
+        if category != "All":
+            mask &= (frame["Product_Category"] == category).to_numpy()
+        if product != "All":
+            mask &= (frame["Product_Name"] == product).to_numpy()
+        return mask
+
+    if hospital != "All" or category != "All" or product != "All":
+        df_mov = df_mov[filter_mask(df_mov)]
+        df_inv = df_inv[filter_mask(df_inv)]
+
+    six_months_ago = today - timedelta(days=180)
+
+    # 1) Consumption last 6 months — df_mov is date-sorted, so the window is
+    # a binary-search slice
+    dates = df_mov["Movement_Date"].to_numpy()
+    start = dates.searchsorted(np.datetime64(six_months_ago))
+    cons_last6 = (
+        df_mov.iloc[start:]
+        .groupby("Product_ID", observed=True, sort=False)["Movement_Qty"]
+        .sum()
+        .rename("Consumption_6M")
+    )
+
+    # 2) Avg days between movements — a stable sort on product alone keeps
+    # the existing date order within each product
+    mov_sorted = df_mov.sort_values("Product_ID", kind="stable")
+    gaps = mov_sorted.groupby("Product_ID", observed=True)["Movement_Date"].diff().dt.days
+    avg_days = (
+        gaps.groupby(mov_sorted["Product_ID"], observed=True, sort=False)
+        .mean()
+        .astype("float32")
+        .rename("Avg_Days_Between")
+    )
+
+    # Single join against the combined per-product stats instead of two merges
+    per_product = pd.concat([cons_last6, avg_days], axis=1)
+    results = df_inv.join(per_product, on="Product_ID")
+    # Back to a plain int dtype once the join NAs are filled, so the weekly-
+    # consumption arithmetic below runs on packed integers — but only when the
+    # sums are integer-backed; fractional uploads keep their float sums, same
+    # as the loader's dtype choice for Movement_Qty.
+    cons = results["Consumption_6M"].fillna(0)
+    if pd.api.types.is_integer_dtype(cons):
+        cons = cons.astype("int32")
+    results["Consumption_6M"] = cons
+
+    # 3) Activity classification — one np.select over (family, threshold)
+    # masks; first match wins, NaN days fall through to D
+    fam = results["Usage_Family"].to_numpy()
+    days = results["Avg_Days_Between"].to_numpy()
+
+    conds, choices = [], []
+    for fam_name, edges in FAMILY_BINS.items():
+        fam_mask = fam == fam_name
+        for edge, label in zip(edges, CLASS_LABELS):
+            conds.append(fam_mask & (days <= edge))
+            choices.append(label)
+
+    results["Activity_Class"] = pd.Categorical(
+        np.select(conds, choices, default="D"),
+        categories=CLASS_LABELS, ordered=True,
+    )
+
+    # 4) Recommended stock — index the multiplier table by (family, class)
+    # codes; unknown families get the conservative low-family row
+    fam_idx = (
+        results["Usage_Family"].map(FAMILY_INDEX)
+        .fillna(FAMILY_INDEX["low"])
+        .astype(int)
+        .to_numpy()
+    )
+    cls_idx = results["Activity_Class"].cat.codes.to_numpy()
+
+    cons_weekly = results["Consumption_6M"].to_numpy() / 26
+    results["Recommended_Stock"] = np.round(
+        cons_weekly * CLASS_MULTIPLIERS[fam_idx, cls_idx]
+    ).astype(int)
+
+    # 5) Expiry risk — digitize the day deltas straight into the 90/180-day
+    # buckets (cheaper than pd.cut's IntervalIndex for three edges); missing
+    # expiry dates have no delta and land in Unknown
+    days_left = (results["Expiry_Date"] - today).dt.days.to_numpy(dtype="float64")
+    risk_labels = np.array(["High", "Medium", "Low"], dtype=object)
+    risk = risk_labels[np.digitize(days_left, [90, 180])]
+    risk[np.isnan(days_left)] = "Unknown"
+    results["Expiry_Risk"] = pd.Categorical(
+        risk, categories=["High", "Medium", "Low", "Unknown"]
+    )
+
+    # 6) Difference vs recommendation / overstock
+    current = results["Current_Stock"].to_numpy(dtype="float64", na_value=np.nan)
+    diff = current - results["Recommended_Stock"].to_numpy()
+    results["Difference"] = diff.astype("float32")
+    results["Overstock"] = diff > 0
+
+    return results
+
+
+results = compute_results(
+    df_mov, df_inv,
+    selected_hospital, selected_category, selected_product,
+    TODAY,
 )
 
-results = df_inv.merge(cons_last6, on="Product_ID", how="left")
-results["Consumption_6M"] = results["Consumption_6M"].fillna(0)
 
-# 2) Avg days between movements
-avg_days_list = []
-for pid in df_mov["Product_ID"].unique():
-    sub = df_mov[df_mov["Product_ID"] == pid].sort_values("Movement_Date")
-    if len(sub) > 1:
-        diffs = sub["Movement_Date"].diff().dt.days[1:]
-        avg_days_list.append([pid, diffs.mean()])
-    else:
-        avg_days_list.append([pid, np.nan])
+@st.cache_data
+def pivot_first(results, values):
+    # Each (product, hospital) pair carries one inventory snapshot, so this
+    # is a plain reshape; drop_duplicates only guards against double rows.
+    # Skips the whole pivot_table/groupby aggregation machinery.
+    return (
+        results.drop_duplicates(["Product_Name", "Hospital_Name"])
+        .set_index(["Product_Name", "Hospital_Name"])[values]
+        .unstack("Hospital_Name")
+    )
 
-avg_days = pd.DataFrame(avg_days_list, columns=["Product_ID", "Avg_Days_Between"])
-results = results.merge(avg_days, on="Product_ID", how="left")
 
-
-# 3) Activity classification
-def classify(row):
-    fam = row["Usage_Family"]
-    days = row["Avg_Days_Between"]
-
-    if pd.isna(days):
-        return "D"
-
-    if fam == "high":
-        if days <= 7: return "A"
-        elif days <= 14: return "B"
-        elif days <= 30: return "C"
-        else: return "D"
-
-    if fam == "medium":
-        if days <= 14: return "A"
-        elif days <= 28: return "B"
-        elif days <= 60: return "C"
-        else: return "D"
-
-    if fam == "low":
-        if days <= 30: return "A"
-        elif days <= 60: return "B"
-        elif days <= 120: return "C"
-        else: return "D"
-
-results["Activity_Class"] = results.apply(classify, axis=1)
-
-
-# 4) Recommended stock
-def recommended(row):
-    cons_weekly = row["Consumption_6M"] / 26
-    fam = row["Usage_Family"]
-    cls = row["Activity_Class"]
-
-    if fam == "high":
-        return round(cons_weekly * {"A":3,"B":2,"C":1,"D":0.2}[cls])
-    if fam == "medium":
-        return round(cons_weekly * {"A":2,"B":1.5,"C":1,"D":0.2}[cls])
-    if fam == "low":
-        return round(cons_weekly * {"A":1,"B":1,"C":1,"D":0}[cls])
-
-results["Recommended_Stock"] = results.apply(recommended, axis=1)
-
-
-# 5) Expiry risk
-def expiry_risk(date):
-    if pd.isna(date):
-        return "Unknown"
-    days_left = (date - today).days
-    if days_left < 90: return "High"
-    elif days_left < 180: return "Medium"
-    else: return "Low"
-
-results["Expiry_Risk"] = results["Expiry_Date"].apply(expiry_risk)
-
-# 6) Overstock
-results["Overstock"] = results["Current_Stock"] > results["Recommended_Stock"]
+@st.cache_data
+def to_csv_bytes(frame):
+    # Memoized so reruns reuse the serialized payload instead of rebuilding
+    # the CSV string on every widget interaction
+    return frame.to_csv(index=False).encode("utf-8")
 
 
 # ---------------------------------------------------
@@ -191,18 +366,20 @@ results["Overstock"] = results["Current_Stock"] > results["Recommended_Stock"]
 st.write("### 📋 Results Table")
 st.dataframe(results)
 
+st.download_button(
+    "⬇️ Download Results CSV",
+    to_csv_bytes(results),
+    file_name="consignment_results.csv",
+    mime="text/csv",
+)
+
 
 # ---------------------------------------------------
 # PIVOT 1 — Recommended Stock
 # ---------------------------------------------------
 st.write("### 📊 Recommended Stock by Hospital")
 
-pivot_rec = results.pivot_table(
-    index="Product_Name",
-    columns="Hospital_Name",
-    values="Recommended_Stock",
-    aggfunc="first"
-).fillna(0)
+pivot_rec = pivot_first(results, "Recommended_Stock").fillna(0)
 
 st.dataframe(pivot_rec.style.format("{:.0f}"))
 
@@ -212,12 +389,7 @@ st.dataframe(pivot_rec.style.format("{:.0f}"))
 # ---------------------------------------------------
 st.write("### 📦 Current Stock by Hospital")
 
-pivot_curr = results.pivot_table(
-    index="Product_Name",
-    columns="Hospital_Name",
-    values="Current_Stock",
-    aggfunc="first"
-).fillna(0)
+pivot_curr = pivot_first(results, "Current_Stock").fillna(0)
 
 st.dataframe(pivot_curr.style.format("{:.0f}"))
 
@@ -227,21 +399,16 @@ st.dataframe(pivot_curr.style.format("{:.0f}"))
 # ---------------------------------------------------
 st.write("### ⏳ Expiry Risk by Hospital")
 
-pivot_exp = results.pivot_table(
-    index="Product_Name",
-    columns="Hospital_Name",
-    values="Expiry_Risk",
-    aggfunc="first"
-).fillna("Unknown")
-
-def color_risk(val):
-    if val == "High":
-        return "background-color: #ffcccc"
-    elif val == "Medium":
-        return "background-color: #ffe4b5"
-    elif val == "Low":
-        return "background-color: #ccffcc"
-    return ""
-
-st.dataframe(pivot_exp.style.applymap(color_risk))
+pivot_exp = pivot_first(results, "Expiry_Risk").fillna("Unknown")
+
+# One vectorized pass over the whole matrix instead of a Python call per cell
+risk_vals = pivot_exp.to_numpy(dtype=object)
+risk_css = np.select(
+    [risk_vals == "High", risk_vals == "Medium", risk_vals == "Low"],
+    ["background-color: #ffcccc", "background-color: #ffe4b5", "background-color: #ccffcc"],
+    default="",
+)
+risk_css = pd.DataFrame(risk_css, index=pivot_exp.index, columns=pivot_exp.columns)
+
+st.dataframe(pivot_exp.style.apply(lambda _: risk_css, axis=None))
 
@@ -0,0 +1,35 @@
+"""Rebuild the typed Parquet copy of the demo dataset.
+
+The CSV stays the canonical, human-editable source. The app prefers the
+Parquet copy because it loads with the category/Int32/datetime dtypes already
+baked in — no CSV parsing or type inference on cold start.
+
+Usage: python build_demo.py
+"""
+import pandas as pd
+
+DEMO_CSV = "hospital_consignment_demo.csv"
+DEMO_PARQUET = "hospital_consignment_demo.parquet"
+
+CATEGORY_COLS = [
+    "Record_Type", "Hospital_ID", "Hospital_Name",
+    "Product_ID", "Product_Name", "Product_Category", "Usage_Family",
+]
+DATE_COLS = ["Movement_Date", "Expiry_Date", "Consignment_Start_Date"]
+NUMERIC_COLS = ["Movement_Qty", "Current_Stock"]
+
+
+def main():
+    df = pd.read_csv(DEMO_CSV)
+    for c in CATEGORY_COLS:
+        df[c] = df[c].astype("category")
+    for c in DATE_COLS:
+        df[c] = pd.to_datetime(df[c], format="ISO8601", errors="coerce")
+    for c in NUMERIC_COLS:
+        df[c] = pd.to_numeric(df[c], errors="coerce").astype("Int32")
+    df.to_parquet(DEMO_PARQUET, compression="snappy", index=False)
+    print(f"Wrote {DEMO_PARQUET} ({len(df)} rows)")
+
+
+if __name__ == "__main__":
+    main()